@@ -1,8 +1,14 @@
 from cropper import crop_images
-from search import search_items_batch  # Import the batch function
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from search import search_items_batch, similar_items, catalog_fusion_enabled, SimilarityGraphUnavailable  # Import the batch function
+from cancellation import CancellationToken, RequestCancelled
+import profiling
+from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import hmac
+import math
 import os
 import shutil
 from fastapi.staticfiles import StaticFiles
@@ -22,19 +28,149 @@ app.add_middleware(
 UPLOAD_DIR = "uploaded_images"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# --- Inference deadlines and cancellation ---
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", 30))
+MAX_REQUEST_TIMEOUT_SECONDS = float(os.environ.get("MAX_REQUEST_TIMEOUT_SECONDS", 120))
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 1))  # torch already uses every core
+DISCONNECT_POLL_SECONDS = 0.1
+
+_inference_slots = asyncio.Semaphore(INFERENCE_WORKERS)
+inference_stats = {"completed": 0, "cancelled": 0, "timed_out": 0, "dropped_before_start": 0}
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def request_timeout(request):
+    """Deadline in seconds, overridable per request with an X-Request-Timeout header."""
+    header = request.headers.get("X-Request-Timeout")
+    if header is None:
+        return REQUEST_TIMEOUT_SECONDS
+    try:
+        timeout = float(header)
+    except ValueError:
+        return REQUEST_TIMEOUT_SECONDS
+    # nan/inf would slip past the clamp and disable the deadline
+    if not math.isfinite(timeout):
+        return REQUEST_TIMEOUT_SECONDS
+    return min(max(timeout, 0.0), MAX_REQUEST_TIMEOUT_SECONDS)
+
+async def _watch_disconnect(request, token):
+    while not token.is_cancelled():
+        if await request.is_disconnected():
+            token.cancel("disconnected")
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+async def run_inference(request, pipeline, *args):
+    """Run a blocking pipeline(*args, token) in the threadpool, one slot per INFERENCE_WORKERS.
+
+    Requests whose client disconnects or whose deadline passes are dropped while
+    queued; once running, the pipeline checks the token between stages.
+    """
+    token = CancellationToken(request_timeout(request))
+    watcher = asyncio.create_task(_watch_disconnect(request, token))
+    started = False
+    try:
+        acquire = asyncio.ensure_future(_inference_slots.acquire())
+        try:
+            while not acquire.done():
+                await asyncio.wait({acquire}, timeout=DISCONNECT_POLL_SECONDS)
+                if not acquire.done():
+                    token.check()
+        except RequestCancelled:
+            acquire.cancel()
+            raise
+
+        try:
+            token.check()
+            started = True
+            result = await run_in_threadpool(profiling.profiled, pipeline, *args, token)
+        finally:
+            _inference_slots.release()
+
+        inference_stats["completed"] += 1
+        return result
+    except RequestCancelled as e:
+        inference_stats["timed_out" if e.reason == "timeout" else "cancelled"] += 1
+        if not started:
+            inference_stats["dropped_before_start"] += 1
+        print(f"⏹️ Inference {e.reason} ({'queued' if not started else 'running'})")
+        raise
+    finally:
+        watcher.cancel()
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled_handler(request, exc):
+    if exc.reason == "timeout":
+        return JSONResponse(status_code=504, content={"detail": "Inference deadline exceeded"})
+    # Client is gone; nobody will read this (499 = client closed request)
+    return Response(status_code=499)
+
+def _search_upload(file_location, description, query_image_weight, catalog_image_weight, token):
+    images = None
+    if file_location is not None:
+        # Crop and process
+        with profiling.stage("crop_images"):
+            cropped_images = crop_images(file_location)
+        images = [crop[2] for crop in cropped_images]
+        token.check()
+
+    # Call search with images if available, plus description
+    with profiling.stage("search_items_batch"):
+        return search_items_batch(
+            images=images,
+            descriptions=[description] if description else None,
+            token=token,
+            query_image_weight=query_image_weight,
+            catalog_image_weight=catalog_image_weight
+        )
+
+def _search_upload_detailed(file_location, catalog_image_weight, token):
+    # Get cropped images - format: (x, y, image)
+    with profiling.stage("crop_images"):
+        cropped_images = crop_images(file_location)
+    token.check()
+
+    # Extract just the images for batch processing
+    images = [cropped_image[2] for cropped_image in cropped_images]
+
+    # Use batch processing
+    with profiling.stage("search_items_batch"):
+        return cropped_images, search_items_batch(images, token=token, catalog_image_weight=catalog_image_weight)
+
+def flatten_products(batch_results):
+    """Flatten per-crop results, keeping only the first (best crop) hit for each product."""
+    products = []
+    seen = set()
+    for found_products in batch_results:
+        for product in found_products:
+            product["image_path"] = product["image_path"].replace("\\", "/")
+            if product["image_path"] in seen:
+                continue
+            seen.add(product["image_path"])
+            products.append(product)
+    return products
+
 # 🔍 Example root endpoint (health check)
 @app.get("/")
 def read_root():
     return {"message": "FastAPI is ready for React!"}
 
+@app.get("/inference-stats")
+def get_inference_stats():
+    return inference_stats
+
 # --- Optimized Image Upload Endpoint with Batch Processing ---
 
 @app.post("/upload-image/")
 async def upload_image(
+    request: Request,
     file: UploadFile = File(None),
-    description: str = Form(None)  # Accept description optionally
+    description: str = Form(None),  # Accept description optionally
+    # Fusion weights: crop vs. description, and catalog image vs. catalog text similarity
+    query_image_weight: float = Form(0.5, ge=0.0, le=1.0),
+    catalog_image_weight: float = Form(0.5, ge=0.0, le=1.0)
 ):
-    images = None
     file_location = None
 
     if file is not None:
@@ -44,48 +180,40 @@ async def upload_image(
         with open(file_location, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
-        # Crop and process
-        cropped_images = crop_images(file_location)
-        images = [crop[2] for crop in cropped_images]
-
-    # Call search with images if available, plus description
-    batch_results = search_items_batch(
-        images=images,
-        descriptions=[description] if description else None
+    # Crop and search off the event loop; stops early if the client goes away
+    batch_results = await run_inference(
+        request, _search_upload, file_location, description, query_image_weight, catalog_image_weight
     )
 
-    # Clean up product image paths
-    products = []
-    for found_products in batch_results:
-        for product in found_products:
-            product["image_path"] = product["image_path"].replace("\\", "/")
-        products.extend(found_products)
+    # Clean up product image paths and drop products already found by another crop
+    products = flatten_products(batch_results)
 
     return JSONResponse(content={
         "filename": file.filename if file else None,
         "message": "Upload successful",
         "file_path": file_location,
-        "product": products
+        "product": products,
+        "catalog_fusion": catalog_fusion_enabled()  # False: catalog_image_weight was ignored
     })
 
 
 # --- Alternative endpoint with detailed crop information ---
 @app.post("/upload-image-detailed/")
-async def upload_image_detailed(file: UploadFile = File(...)):
+async def upload_image_detailed(
+    request: Request,
+    file: UploadFile = File(...),
+    catalog_image_weight: float = Form(0.5, ge=0.0, le=1.0)
+):
     file_location = os.path.join(UPLOAD_DIR, file.filename)
     
     # Save the uploaded image
     with open(file_location, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     
-    # Get cropped images - format: (x, y, image)
-    cropped_images = crop_images(file_location)
-    
-    # Extract just the images for batch processing
-    images = [cropped_image[2] for cropped_image in cropped_images]
-    
-    # Use batch processing
-    batch_results = search_items_batch(images)
+    # Crop and search off the event loop; stops early if the client goes away
+    cropped_images, batch_results = await run_inference(
+        request, _search_upload_detailed, file_location, catalog_image_weight
+    )
     
     # Build detailed response with crop coordinates
     detailed_results = []
@@ -103,19 +231,61 @@ async def upload_image_detailed(file: UploadFile = File(...)):
             "products": found_products
         })
     
-    # Also create flattened list for backward compatibility
-    all_products = []
-    for result in detailed_results:
-        all_products.extend(result["products"])
+    # Also create flattened (deduplicated) list for backward compatibility
+    all_products = flatten_products(batch_results)
     
     return JSONResponse(content={
         "filename": file.filename,
         "message": "Upload successful",
         "file_path": file_location,
         "product": all_products,  # Backward compatibility
-        "detailed_results": detailed_results  # New detailed format
+        "detailed_results": detailed_results,  # New detailed format
+        "catalog_fusion": catalog_fusion_enabled()  # False: catalog_image_weight was ignored
+    })
+
+# --- "More like this": constant-time lookup in the precomputed neighbor graph ---
+@app.get("/similar/{product_id}")
+def get_similar(product_id: int, k: int = Query(5, ge=1)):
+    try:
+        found_products, scores = similar_items(product_id, k)
+    except IndexError:
+        raise HTTPException(status_code=404, detail=f"Unknown product id {product_id}")
+    except SimilarityGraphUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return JSONResponse(content={
+        "product_id": product_id,
+        # Neighbors are distinct rows already; copy so the cached metadata isn't mutated
+        "product": [dict(p, image_path=p["image_path"].replace("\\", "/")) for p in found_products],
+        "scores": scores
     })
 
+# --- Admin: profile the next N requests / T seconds ---
+def require_admin(request):
+    supplied = request.headers.get("X-Admin-Token", "")
+    # Compare bytes: compare_digest rejects non-ASCII str, which would surface as a 500
+    if not ADMIN_TOKEN or not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.post("/admin/profile")
+def start_profile(
+    request: Request,
+    requests: int = Query(None, ge=1),
+    seconds: float = Query(None, gt=0)
+):
+    """Sample Python stacks and torch-trace upload requests; writes a flamegraph + Chrome traces under PROFILE_DIR."""
+    require_admin(request)
+    try:
+        profiling.start(max_requests=requests, seconds=seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiling.status()
+
+@app.get("/admin/profile")
+def get_profile_status(request: Request):
+    require_admin(request)
+    return profiling.status()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,33 @@
+import threading
+import time
+
+
+class RequestCancelled(Exception):
+    """Raised between pipeline stages once nobody is waiting for the result."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason  # "timeout" or "disconnected"
+
+
+class CancellationToken:
+    """Per-request deadline plus a cancel flag that is safe to share with worker threads."""
+
+    def __init__(self, timeout):
+        self.deadline = time.monotonic() + timeout
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def is_cancelled(self):
+        if not self._event.is_set() and time.monotonic() >= self.deadline:
+            self.cancel("timeout")
+        return self._event.is_set()
+
+    def check(self):
+        if self.is_cancelled():
+            raise RequestCancelled(self.reason)
@@ -1,4 +1,7 @@
+import os
+import numpy as np
 import torch
+from torchvision.ops import nms
 from transformers import YolosImageProcessor, YolosForObjectDetection
 from PIL import Image
 
@@ -6,39 +9,66 @@ from PIL import Image
 processor = YolosImageProcessor.from_pretrained("valentinafeve/yolos-fashionpedia")
 model = YolosForObjectDetection.from_pretrained("valentinafeve/yolos-fashionpedia")
 
-def crop_images(path):
-    # Load image
-    image = Image.open(path).convert("RGB")
+# Per-image work budget
+NMS_IOU_THRESHOLD = float(os.environ.get("NMS_IOU_THRESHOLD", 0.5))  # boxes overlapping more than this are treated as the same garment
+MAX_CROPS_PER_IMAGE = int(os.environ.get("MAX_CROPS_PER_IMAGE", 4))   # every crop costs one CLIP encode + one index search
+MIN_BOX_AREA = float(os.environ.get("MIN_BOX_AREA", 0.01))           # fraction of the full image area
+
+def crop_images(path, iou_threshold=NMS_IOU_THRESHOLD, max_crops=MAX_CROPS_PER_IMAGE, min_box_area=MIN_BOX_AREA):
+    # Decode once into an HxWx3 uint8 array; crops below are views into it
+    image = np.array(Image.open(path).convert("RGB"))
+    height, width = image.shape[:2]
 
     # Inference
     inputs = processor(images=image, return_tensors="pt")
     outputs = model(**inputs)
 
-    target_sizes = torch.tensor([image.size[::-1]])
+    target_sizes = torch.tensor([[height, width]])
     results = processor.post_process_object_detection(outputs, target_sizes=target_sizes, threshold=0.3)[0]
 
     # Labels to skip or keep
     sleeve_labels = {"sleeve", "sleeveless", "short sleeve", "long sleeve"}
     interested_labels = {"shirt", "pants", "jacket", "t-shirt", "top", "sweatshirt"}
 
-    cropped_images = []
+    image_area = height * width
+    keep = []
 
-    for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
+    for i, (label, box) in enumerate(zip(results["labels"], results["boxes"])):
         category = model.config.id2label[label.item()]
         split_labels = [c.strip().lower() for c in category.split(",")]
 
         if any(label in sleeve_labels for label in split_labels):
             continue
 
+        if not any(label in interested_labels for label in split_labels):
+            continue
+
         xmin, ymin, xmax, ymax = box.tolist()
+        if (xmax - xmin) * (ymax - ymin) < min_box_area * image_area:
+            continue
 
-        if any(label in interested_labels for label in split_labels):
-            cropped = image.crop((int(xmin), int(ymin), int(xmax), int(ymax)))
-            cropped_images.append((category, round(score.item(), 2), cropped))
+        keep.append(i)
 
-    return cropped_images
+    if not keep:
+        return []
 
+    # Class-agnostic NMS: "shirt, blouse" and "top, t-shirt, sweatshirt" boxes
+    # around the same garment collapse into the highest scoring one.
+    # nms returns indices sorted by decreasing score, so truncating keeps the best crops.
+    keep = torch.tensor(keep)
+    boxes = results["boxes"][keep]
+    scores = results["scores"][keep]
+    kept = keep[nms(boxes, scores, iou_threshold)][:max_crops]
 
+    cropped_images = []
 
+    for i in kept.tolist():
+        score = results["scores"][i]
+        category = model.config.id2label[results["labels"][i].item()]
+        xmin, ymin, xmax, ymax = results["boxes"][i].tolist()
 
+        xmin, ymin = max(int(xmin), 0), max(int(ymin), 0)
+        cropped = image[ymin:int(ymax), xmin:int(xmax)]
+        cropped_images.append((category, round(score.item(), 2), cropped))
 
+    return cropped_images
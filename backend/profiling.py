@@ -0,0 +1,234 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+
+from torch.profiler import ProfilerActivity, profile, record_function
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 300))  # sessions always end
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+# Active session, or None. Everything below checks this first so that
+# profiling costs one global read per request while it is switched off.
+_session = None
+_session_lock = threading.Lock()
+_last_output_dir = None
+_local = threading.local()
+_NOOP = contextlib.nullcontext()
+
+
+class ProfileSession:
+    """Samples every thread's Python stack and torch-profiles up to max_requests requests."""
+
+    def __init__(self, max_requests=None, seconds=None, interval=SAMPLE_INTERVAL_SECONDS):
+        self.output_dir = os.path.join(PROFILE_DIR, datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+        self.remaining_requests = max_requests
+        self.deadline = time.monotonic() + min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self.interval = interval
+        self.stacks = Counter()
+        self.traced_requests = 0
+        self._busy = False  # torch.profiler supports one active profile per process
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._sampler.start()
+
+    def _sample(self):
+        sampler_id = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                finish(self)
+                break
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[tuple(reversed(stack))] += 1
+
+        # Output is written here, never on a request thread
+        try:
+            self.write()
+        except Exception as e:
+            print(f"⚠️ Failed to write profile to {self.output_dir}: {e}")
+
+    def claim(self):
+        """Reserve the torch profiler for one request, if the budget allows."""
+        with self._lock:
+            if self._busy or self._stopped.is_set() or self.remaining_requests == 0:
+                return False
+            self._busy = True
+            if self.remaining_requests is not None:
+                self.remaining_requests -= 1
+            self.traced_requests += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._busy = False
+            done = self.remaining_requests == 0
+        if done:
+            finish(self)
+
+    def write(self):
+        stacks = dict(self.stacks)
+        with open(os.path.join(self.output_dir, "cpu.folded"), "w") as f:
+            for stack, count in stacks.items():
+                f.write(f"{';'.join(stack)} {count}\n")
+        write_flamegraph_svg(stacks, os.path.join(self.output_dir, "cpu_flamegraph.svg"))
+        print(f"📈 Profile written to {self.output_dir}")
+
+
+def start(max_requests=None, seconds=None):
+    global _session
+    with _session_lock:
+        if _session is not None:
+            raise RuntimeError("A profiling session is already running")
+        _session = ProfileSession(max_requests, seconds)
+        _session.start()
+        return _session
+
+
+def finish(session):
+    """End a session (budget spent or deadline passed); its sampler thread then writes the flamegraph."""
+    global _session, _last_output_dir
+    with _session_lock:
+        if session._stopped.is_set():
+            return
+        session._stopped.set()
+        if _session is session:
+            _session = None
+        _last_output_dir = session.output_dir
+
+
+def status():
+    session = _session
+    if session is None:
+        return {"active": False, "last_output_dir": _last_output_dir}
+    return {
+        "active": True,
+        "output_dir": session.output_dir,
+        "remaining_requests": session.remaining_requests,
+        "seconds_left": round(max(session.deadline - time.monotonic(), 0.0), 1),
+        "traced_requests": session.traced_requests,
+        "last_output_dir": _last_output_dir,
+    }
+
+
+def profiled(fn, *args):
+    """Call fn(*args), under torch.profiler if a session is active and has budget left."""
+    session = _session
+    if session is None or not session.claim():
+        return fn(*args)
+
+    # A profiling failure must never fail the request itself
+    trace_path = os.path.join(session.output_dir, f"request_{session.traced_requests}_trace.json")
+    try:
+        prof = profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+        prof.start()
+    except Exception as e:
+        print(f"⚠️ Failed to start torch profiler: {e}")
+        prof = None
+
+    _local.active = prof is not None
+    try:
+        return fn(*args)
+    finally:
+        _local.active = False
+        if prof is not None:
+            try:
+                prof.stop()
+                threading.Thread(target=_export_trace, args=(prof, trace_path), daemon=True).start()
+            except Exception as e:
+                print(f"⚠️ Failed to stop torch profiler: {e}")
+        session.release()
+
+
+def _export_trace(prof, path):
+    try:
+        prof.export_chrome_trace(path)
+    except Exception as e:
+        print(f"⚠️ Failed to write torch trace {path}: {e}")
+
+
+def stage(name):
+    """Label a pipeline stage in the torch trace; a shared no-op when the request isn't traced."""
+    if getattr(_local, "active", False):
+        return record_function(name)
+    return _NOOP
+
+
+# ===== FLAMEGRAPH ===== #
+def write_flamegraph_svg(stacks, path, width=1200, row_height=16, min_width=0.1):
+    """Render folded stacks (root first) as a static SVG flamegraph."""
+    root = {"value": 0, "children": {}}
+    for stack, count in stacks.items():
+        node = root
+        node["value"] += count
+        for frame in stack:
+            node = node["children"].setdefault(frame, {"value": 0, "children": {}})
+            node["value"] += count
+
+    if root["value"] == 0:
+        # No samples (e.g. the session ended on its first tick): write an empty graph
+        with open(path, "w") as f:
+            f.write(
+                f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{row_height}" '
+                f'font-family="monospace" font-size="11"><text x="2" y="{row_height - 4}">No samples</text></svg>\n'
+            )
+        return
+
+    total = root["value"]
+    rects = []
+    todo = [("all", root, 0.0, 0)]
+    while todo:
+        name, node, x, depth = todo.pop()
+        w = node["value"] / total * width
+        if w < min_width:
+            continue
+        rects.append((name, node["value"], x, depth, w))
+        child_x = x
+        for child_name, child in node["children"].items():
+            todo.append((child_name, child, child_x, depth + 1))
+            child_x += child["value"] / total * width
+
+    max_depth = max(depth for _, _, _, depth, _ in rects)
+    height = (max_depth + 1) * row_height
+
+    with open(path, "w") as f:
+        f.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">\n'
+        )
+        for name, value, x, depth, w in rects:
+            y = height - (depth + 1) * row_height
+            hue = zlib.crc32(name.encode()) % 60  # stable red..yellow per frame
+            f.write(
+                f'<g><title>{_escape(name)} ({value} samples, {value / total:.1%})</title>'
+                f'<rect x="{x:.2f}" y="{y}" width="{w:.2f}" height="{row_height - 1}" fill="hsl({hue},80%,60%)"/>'
+            )
+            chars = int(w // 7)
+            if chars >= 3:
+                text = name if len(name) <= chars else name[:chars - 2] + ".."
+                f.write(f'<text x="{x + 2:.2f}" y="{y + row_height - 4}">{_escape(text)}</text>')
+            f.write("</g>\n")
+        f.write("</svg>\n")
+
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
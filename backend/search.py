@@ -9,14 +9,21 @@ import torch
 
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+IMAGE_EMBEDDINGS_PATH = "gap_image_embeddings.npy"
+TEXT_EMBEDDINGS_PATH = "gap_text_embeddings.npy"
+
 # Global variables to cache loaded models and data
 _fclip = None
 _faiss_index = None
+_catalog_embeddings = None  # (2N, d): image rows stacked on top of text rows
+_catalog_embeddings_checked = False
 _metadata = None
+_similar_ids = None
+_similar_scores = None
 
 def load_models_and_data():
     """Load models and data once and cache them"""
-    global _fclip, _faiss_index, _metadata
+    global _fclip, _faiss_index, _catalog_embeddings, _catalog_embeddings_checked
     
     if _fclip is None:
         print("Loading FashionCLIP model...")
@@ -36,11 +43,76 @@ def load_models_and_data():
     if _faiss_index is None:
         print("Loading FAISS index...")
         _faiss_index = faiss.read_index("gap_faiss.index")
+
+    # Separate image/text catalog vectors (written by generate_embeddings.py) enable
+    # query-time fusion; without them we fall back to the pre-blended FAISS index
+    if not _catalog_embeddings_checked:
+        _catalog_embeddings_checked = True
+        if os.path.isfile(IMAGE_EMBEDDINGS_PATH) and os.path.isfile(TEXT_EMBEDDINGS_PATH):
+            print("Loading image/text catalog embeddings...")
+            _catalog_embeddings = np.concatenate([
+                np.load(IMAGE_EMBEDDINGS_PATH),
+                np.load(TEXT_EMBEDDINGS_PATH)
+            ]).astype("float32")
+        else:
+            print(f"⚠️ {IMAGE_EMBEDDINGS_PATH} / {TEXT_EMBEDDINGS_PATH} not found: using the pre-blended "
+                  "FAISS index, catalog_image_weight is ignored. Re-run generate_embeddings.py to enable it.")
     
+    load_metadata()
+
+def load_metadata():
+    """Load product metadata once; each product's id is its row in the embeddings/index"""
+    global _metadata
+
     if _metadata is None:
         print("Loading metadata...")
         with open("gap_metadata.json") as f:
             _metadata = json.load(f)
+        for i, item in enumerate(_metadata):
+            item["id"] = i
+
+class SimilarityGraphUnavailable(Exception):
+    """The neighbor graph is missing or was built for a different catalog."""
+
+def load_similarity_graph():
+    """Load the precomputed neighbor graph (see data_collectors/build_similarity_graph.py)"""
+    global _similar_ids, _similar_scores
+
+    load_metadata()
+
+    if _similar_ids is None:
+        print("Loading similarity graph...")
+        try:
+            ids = np.load("gap_similar_ids.npy", mmap_mode="r")
+            scores = np.load("gap_similar_scores.npy", mmap_mode="r")
+        except FileNotFoundError:
+            raise SimilarityGraphUnavailable(
+                "Similarity graph not found; run data_collectors/build_similarity_graph.py"
+            )
+
+        # Rows are catalog positions, so a graph built for another catalog is useless
+        if len(ids) != len(_metadata) or ids.shape != scores.shape:
+            raise SimilarityGraphUnavailable(
+                f"Similarity graph has {len(ids)} rows but the catalog has {len(_metadata)} products; "
+                "re-run data_collectors/build_similarity_graph.py"
+            )
+
+        _similar_ids, _similar_scores = ids, scores
+
+def similar_items(product_id, k=5):
+    """Nearest catalog products to product_id and their similarities, read straight from the precomputed graph."""
+    load_similarity_graph()
+
+    if not 0 <= product_id < len(_similar_ids):
+        raise IndexError(f"Unknown product id {product_id}")
+
+    neighbors = _similar_ids[product_id, :k]
+    if len(neighbors) and not 0 <= neighbors.min() <= neighbors.max() < len(_metadata):
+        raise SimilarityGraphUnavailable("Similarity graph points outside the catalog; re-run data_collectors/build_similarity_graph.py")
+
+    items = [_metadata[idx] for idx in neighbors]
+    scores = _similar_scores[product_id, :k].astype(float).tolist()
+    return items, scores
 
 def search_items(image, description=None):
     # Load models and data (cached after first call)
@@ -85,10 +157,52 @@ def search_items(image, description=None):
     return items
 
 import torch
+import torch.nn.functional as F
 from PIL import Image
 
-def search_items_batch(images=None, descriptions=None):
-    """Search using image embeddings, text embeddings, or both (averaged)."""
+def preprocess_crops(images):
+    """Resize and normalize uint8 HxWx3 crops straight into one CLIP pixel batch."""
+    image_processor = _fclip.preprocess.image_processor
+    size = image_processor.crop_size["height"]
+    # Fold the 1/255 rescale into mean/std so normalization is a single in-place pass
+    mean = torch.tensor(image_processor.image_mean).view(1, 3, 1, 1) * 255
+    std = torch.tensor(image_processor.image_std).view(1, 3, 1, 1) * 255
+
+    batch = torch.empty((len(images), 3, size, size), dtype=torch.float32)
+    for i, img in enumerate(images):
+        if isinstance(img, Image.Image):
+            img = np.array(img.convert("RGB"))
+        crop = torch.from_numpy(img).permute(2, 0, 1).unsqueeze(0).float()
+        batch[i] = F.interpolate(crop, size=(size, size), mode="bicubic", antialias=True, align_corners=False)[0]
+
+    batch.clamp_(0, 255).sub_(mean).div_(std)
+    return batch
+
+def catalog_fusion_enabled():
+    """True when catalog_image_weight takes effect (split image/text catalog vectors are loaded)."""
+    return _catalog_embeddings is not None
+
+def fused_search(queries, catalog_image_weight=0.5, k=5):
+    """Top-k catalog rows by weighted image/text similarity, from one matmul over both matrices."""
+    n = len(_catalog_embeddings) // 2
+    weights = np.array([catalog_image_weight, 1.0 - catalog_image_weight], dtype="float32")
+
+    sims = queries @ _catalog_embeddings.T                            # (q, 2N)
+    sims = np.einsum("m,qmn->qn", weights, sims.reshape(len(queries), 2, n))
+
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+def search_items_batch(images=None, descriptions=None, token=None, query_image_weight=0.5, catalog_image_weight=0.5):
+    """Search using image embeddings, text embeddings, or both (weighted).
+
+    query_image_weight blends each crop with the description on the query side
+    (a single description is applied to every crop); catalog_image_weight blends
+    catalog image vs. text similarity at search time.
+    If a CancellationToken is passed, it is checked between stages so abandoned
+    requests stop before the next encode or index search.
+    """
     load_models_and_data()
 
     fclip = _fclip
@@ -105,36 +219,55 @@ def search_items_batch(images=None, descriptions=None):
 
     # Process image embeddings if provided
     if images:
-        query_imgs = [img.convert("RGB").resize((224, 224)) for img in images]
+        pixel_values = preprocess_crops(images).to(fclip.device)
         with torch.no_grad():
-            query_img_embs = fclip.encode_images(query_imgs, batch_size=len(query_imgs))
+            query_img_embs = fclip.model.get_image_features(pixel_values=pixel_values).cpu().numpy()
+        if token is not None:
+            token.check()
 
     # Process text embeddings if provided
     if descriptions:
         with torch.no_grad():
             query_txt_embs = fclip.encode_text(descriptions, batch_size=len(descriptions))
+        if token is not None:
+            token.check()
 
     num_queries = max(len(query_img_embs), len(query_txt_embs))
+    queries = []
+
+    # One description for the whole upload is blended into every crop
+    broadcast_text = len(query_txt_embs) == 1
 
     for i in range(num_queries):
+        txt_i = 0 if broadcast_text else i
         has_image = i < len(query_img_embs)
-        has_text = i < len(query_txt_embs)
+        has_text = txt_i < len(query_txt_embs)
 
         if has_image and has_text:
-            # Combine image + text
-            emb = (query_img_embs[i] + query_txt_embs[i]) * 0.5
+            # Combine image + text; normalize each first, as the catalog side does,
+            # so the weight isn't skewed by CLIP's differing image/text norms
+            img_emb = query_img_embs[i] / np.linalg.norm(query_img_embs[i])
+            txt_emb = query_txt_embs[txt_i] / np.linalg.norm(query_txt_embs[txt_i])
+            emb = query_image_weight * img_emb + (1.0 - query_image_weight) * txt_emb
         elif has_image:
             emb = query_img_embs[i]
         elif has_text:
-            emb = query_txt_embs[i]
+            emb = query_txt_embs[txt_i]
         else:
             continue  # Skip if no embedding available (shouldn't happen)
 
-        emb = emb / np.linalg.norm(emb)
-        emb = emb.astype("float32")
+        queries.append(emb / np.linalg.norm(emb))
+
+    queries = np.stack(queries).astype("float32")
+
+    # All crops are searched in one call
+    if _catalog_embeddings is not None:
+        I = fused_search(queries, catalog_image_weight, k=5)
+    else:
+        D, I = faiss_index.search(queries, k=5)
 
-        D, I = faiss_index.search(emb.reshape(1, -1), k=5)
-        items = [metadata[idx] for score, idx in zip(D[0], I[0])]
+    for indices in I:
+        items = [metadata[idx] for idx in indices]
         results.append(items)
 
     return results
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+# ===== CONFIGURATION ===== #
+EMBEDDINGS_PATH = "gap_embeddings.npy"
+IDS_OUTPUT_PATH = "gap_similar_ids.npy"        # (N, K) int32 neighbor row indices
+SCORES_OUTPUT_PATH = "gap_similar_scores.npy"  # (N, K) float16 cosine similarities
+K = 20                # neighbors stored per product
+BLOCK_ROWS = 1024     # query rows per matmul
+BLOCK_COLS = 16384    # catalog columns per matmul
+# Peak working memory per step is about BLOCK_ROWS * (K + BLOCK_COLS) * 12 bytes
+# (float32 candidate scores plus argpartition's int64 indices), ~200 MB at the defaults
+
+
+# ===== BLOCKED TOP-K ===== #
+def topk_neighbors(embeddings, k=K, block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS):
+    """Top-k inner-product neighbors of every row, excluding the row itself."""
+    n = len(embeddings)
+    k = min(k, n - 1)
+    ids = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float16)
+
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        queries = np.asarray(embeddings[start:stop], dtype=np.float32)
+        rows = np.arange(start, stop)
+
+        # Running top-k for this row block, merged with each column block in turn
+        best_scores = np.full((stop - start, k), -np.inf, dtype=np.float32)
+        best_ids = np.full((stop - start, k), -1, dtype=np.int64)
+
+        for col in range(0, n, block_cols):
+            col_stop = min(col + block_cols, n)
+            sims = queries @ np.asarray(embeddings[col:col_stop], dtype=np.float32).T
+
+            # A product is not its own neighbor
+            self_rows = np.nonzero((rows >= col) & (rows < col_stop))[0]
+            sims[self_rows, rows[self_rows] - col] = -np.inf
+
+            cand_scores = np.concatenate([best_scores, sims], axis=1)
+            del sims
+            top = np.argpartition(cand_scores, -k, axis=1)[:, -k:]
+            best_scores = np.take_along_axis(cand_scores, top, axis=1)
+            del cand_scores
+
+            # Candidate columns < k are the previous best; the rest map to catalog rows col + (top - k)
+            previous = np.take_along_axis(best_ids, np.minimum(top, k - 1), axis=1)
+            best_ids = np.where(top < k, previous, col + top - k)
+
+        order = np.argsort(-best_scores, axis=1)
+        ids[start:stop] = np.take_along_axis(best_ids, order, axis=1)
+        scores[start:stop] = np.take_along_axis(best_scores, order, axis=1)
+        print(f"Processed {stop}/{n} products")
+
+    return ids, scores
+
+
+# ===== MAIN ENTRY POINT ===== #
+def main():
+    # Memory-map so large catalogs are streamed block by block
+    embeddings = np.load(EMBEDDINGS_PATH, mmap_mode="r")
+    ids, scores = topk_neighbors(embeddings)
+
+    np.save(IDS_OUTPUT_PATH, ids)
+    np.save(SCORES_OUTPUT_PATH, scores)
+    print(f"Saved {ids.shape[1]} neighbors for {ids.shape[0]} products to {IDS_OUTPUT_PATH} / {SCORES_OUTPUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,9 +18,19 @@ images_batch = []
 texts_batch = []
 metadata_batch = []
 
-embeddings = []
+image_embeddings = []
+text_embeddings = []
 metadata = []
 
+def normalize(emb):
+    # Normalize each vector individually
+    return emb / np.linalg.norm(emb, axis=1, keepdims=True)
+
+def encode_batch(images, texts):
+    # Image and text vectors are kept separate so the blend can be chosen at query time
+    image_embeddings.extend(normalize(fclip.encode_images(images, batch_size=len(images))))
+    text_embeddings.extend(normalize(fclip.encode_text(texts, batch_size=len(texts))))
+
 for item in catalog:
     img_path = item["image_path"]
     if "Image not found" in img_path or not os.path.isfile(img_path):
@@ -41,14 +51,7 @@ for item in catalog:
 
     # When batch is full, process it
     if len(images_batch) == batch_size:
-        img_emb = fclip.encode_images(images_batch, batch_size=batch_size)
-        txt_emb = fclip.encode_text(texts_batch, batch_size=batch_size)
-        combined = (img_emb + txt_emb) / 2
-        # Normalize each vector individually
-        norms = np.linalg.norm(combined, axis=1, keepdims=True)
-        combined = combined / norms
-
-        embeddings.extend(combined)
+        encode_batch(images_batch, texts_batch)
         metadata.extend(metadata_batch)
 
         images_batch = []
@@ -57,17 +60,19 @@ for item in catalog:
 
 # Process any remaining items in the last batch
 if images_batch:
-    img_emb = fclip.encode_images(images_batch, batch_size=len(images_batch))
-    txt_emb = fclip.encode_text(texts_batch, batch_size=len(texts_batch))
-    combined = (img_emb + txt_emb) / 2
-    norms = np.linalg.norm(combined, axis=1, keepdims=True)
-    combined = combined / norms
-
-    embeddings.extend(combined)
+    encode_batch(images_batch, texts_batch)
     metadata.extend(metadata_batch)
 
+image_embeddings = np.array(image_embeddings).astype("float32")
+text_embeddings = np.array(text_embeddings).astype("float32")
+
+# Equal-weight blend, kept for the FAISS index and the similarity graph
+combined = normalize(image_embeddings + text_embeddings).astype("float32")
+
 # Save to disk
-np.save("gap_embeddings.npy", np.array(embeddings).astype("float32"))
+np.save("gap_image_embeddings.npy", image_embeddings)
+np.save("gap_text_embeddings.npy", text_embeddings)
+np.save("gap_embeddings.npy", combined)
 with open("gap_metadata.json", "w") as f:
     json.dump(metadata, f, indent=2)
 
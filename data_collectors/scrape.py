@@ -1,120 +1,165 @@
-from selenium import webdriver
-import time
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
+import argparse
+import asyncio
 import json
 from datetime import datetime
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+
+from second_scrape import run_in_batches, JSON_OUTPUT_PATH, CONCURRENT_TABS
+
+
+# ===== CONFIGURATION ===== #
+JSON_LISTING_PATH = "gap_products.json"
+CARD_SELECTOR = ".plp_product-card"
+CONCURRENT_CONTEXTS = 4      # listing pages crawled in parallel, one browser context each
+PAGE_TIMEOUT = 60000         # ms to wait for navigation / the first product card
+SCROLL_SETTLE_TIMEOUT = 3000 # ms to wait for more cards after scrolling before calling the page complete
+
+# "Shop all styles" listing URL per category; page N lives at #pageId=N-1
+CATEGORY_URLS = {
+    "men": "https://www.gap.com/browse/men/shop-all-styles?cid=1127944&nav=meganav%3AMen%3ACategories%3AShop+All+Styles",
+    # Add the "women", "kids" and "baby" shop-all URLs here
+}
+PAGES_PER_CATEGORY = 6
+
+# Runs inside the page: every card's fields in a single DOM evaluation
+EXTRACT_CARDS_JS = """
+cards => cards.map(card => {
+    const name = card.querySelector(".plp_product-card-name");
+    const price = card.querySelector(".plp_product-card-price");
+    const link = card.querySelector(".plp_product-info");
+    return {
+        name: name ? (name.getAttribute("title") || name.innerText.trim()) : "Unknown",
+        price: price ? price.innerText.trim() : "Price not available",
+        url: link ? link.href : null,
+    };
+})
+"""
+
+
+# ===== JOB LIST ===== #
+def build_jobs(category_urls=CATEGORY_URLS, pages=PAGES_PER_CATEGORY):
+    return [
+        {"category": category, "page": page, "url": f"{url}#pageId={page - 1}"}
+        for category, url in category_urls.items()
+        for page in range(1, pages + 1)
+    ]
+
+
+def load_jobs(path):
+    # JSON list of {"category", "page", "url"}. To check the crawler without gap.com,
+    # serve the fixture listing page and crawl it from a scratch directory:
+    #   python -m http.server 8001 --directory data_collectors
+    #   cd "$(mktemp -d)" && python <repo>/data_collectors/scrape.py <repo>/data_collectors/fixtures/jobs.json --no-enrich
+    # gap_products.json should then hold 5 products per job: 3 served up front, 2 rendered
+    # after scrolling, and "Pocket Tee" with the default price and no url.
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ===== CRAWL ONE LISTING PAGE ===== #
+async def load_all_cards(page):
+    # Scroll until no new cards render instead of sleeping a fixed time per card
+    count = await page.locator(CARD_SELECTOR).count()
+    while True:
+        await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+        try:
+            await page.wait_for_function(
+                "([selector, count]) => document.querySelectorAll(selector).length > count",
+                arg=[CARD_SELECTOR, count],
+                timeout=SCROLL_SETTLE_TIMEOUT,
+            )
+        except PlaywrightTimeoutError:
+            return
+        count = await page.locator(CARD_SELECTOR).count()
 
-service = Service(executable_path="chromedriver.exe")
-driver = webdriver.Chrome(service=service)
 
-# List to store all product data
-all_products = []
+async def crawl_listing(browser, job):
+    context = await browser.new_context()
+    page = await context.new_page()
+    try:
+        print(f"Crawling {job['category']} page {job['page']}: {job['url']}")
+        await page.goto(job["url"], timeout=PAGE_TIMEOUT)
+        await page.wait_for_selector(CARD_SELECTOR, timeout=PAGE_TIMEOUT)
+        await load_all_cards(page)
 
-# Manually specify category and page number
-category = "men"  # Change this to: "men", "women", "kids", "baby"
-page_number = 6  # Change this to the page number you want to scrape
+        cards = await page.eval_on_selector_all(CARD_SELECTOR, EXTRACT_CARDS_JS)
+    except Exception as e:
+        print(f"❌ Failed to crawl {job['url']}: {e}")
+        return []
+    finally:
+        await context.close()
+
+    scraped_at = datetime.now().isoformat()
+    products = [
+        {
+            "id": i + 1,
+            "name": card["name"],
+            "price": card["price"],
+            "url": card["url"],
+            "category": job["category"],
+            "page": job["page"],
+            "category_page": f"{job['category']}-pg{job['page']}",
+            "scraped_at": scraped_at,
+        }
+        for i, card in enumerate(cards)
+    ]
+    print(f"✅ Found {len(products)} products on {job['category']} page {job['page']}")
+    return products
 
-# URL to scrape
-url = "https://www.gap.com/browse/men/shop-all-styles?cid=1127944&nav=meganav%3AMen%3ACategories%3AShop+All+Styles#pageId=5"
 
-driver.get(url)
+async def crawl(browser, jobs, concurrent_contexts=CONCURRENT_CONTEXTS):
+    semaphore = asyncio.Semaphore(concurrent_contexts)
 
-time.sleep(10)
+    async def limited_crawl(job):
+        async with semaphore:
+            return await crawl_listing(browser, job)
 
-product_cards = driver.find_elements(By.CLASS_NAME, "plp_product-card")
+    pages = await asyncio.gather(*(limited_crawl(job) for job in jobs))
+    return [product for products in pages for product in products]
 
-print(f"Found {len(product_cards)} product cards")
 
-for i, product_card in enumerate(product_cards):
+# ===== SAVE ===== #
+def merge_products(filename, products):
+    """Add products to a catalog file, replacing anything previously crawled from the same category pages."""
     try:
-        print(f"\n--- Processing Product {i+1}/{len(product_cards)} ---")
+        with open(filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {"scraped_at": datetime.now().isoformat(), "total_products": 0, "products": []}
 
-        # Extract product name
-        try:
-            name_element = product_card.find_element(
-                By.CLASS_NAME, "plp_product-card-name"
-            )
-            product_name = (
-                name_element.get_attribute("title") or name_element.text.strip()
-            )
-            print(f"Name: {product_name}")
-        except:
-            print("Name: Not found")
-            product_name = "Unknown"
+    crawled_pages = {product["category_page"] for product in products}
+    data["products"] = [p for p in data["products"] if p.get("category_page") not in crawled_pages]
+    data["products"].extend(products)
+    data["total_products"] = len(data["products"])
+    data["last_updated"] = datetime.now().isoformat()
 
-        # Extract price
-        try:
-            price_element = product_card.find_element(
-                By.CLASS_NAME, "plp_product-card-price"
-            )
-            price = price_element.text.strip()
-            print(f"Price: {price}")
-        except:
-            print("Price: Not found")
-            price = "Price not available"
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
 
-        # Extract product URL
-        try:
-            url_element = product_card.find_element(By.CLASS_NAME, "plp_product-info")
-            product_url = url_element.get_attribute("href")
-            print(f"URL: {product_url}")
-        except:
-            print("URL: Not found")
-            product_url = None
-
-        # Create product dictionary
-        product_data = {
-            "id": i + 1,
-            "name": product_name,
-            "price": price,
-            "url": product_url,
-            "category": category,
-            "page": page_number,
-            "category_page": f"{category}-pg{page_number}",
-            "scraped_at": datetime.now().isoformat(),
-        }
 
-        # Add to our collection
-        all_products.append(product_data)
-        print(f"✅ Added product {i+1} to collection")
+# ===== MAIN ENTRY POINT ===== #
+async def main(jobs, enrich=True):
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
 
-        time.sleep(1)
+        products = await crawl(browser, jobs)
+        merge_products(JSON_LISTING_PATH, products)
+        print(f"📁 Saved {len(products)} listed products to {JSON_LISTING_PATH}")
 
-        driver.execute_script("window.scrollBy(0, 1000);")
-        time.sleep(0.5)  # Brief pause to let the scroll complete
+        # Hand the new cards straight to the description/image enrichment stage
+        if enrich:
+            await run_in_batches(browser, products, CONCURRENT_TABS)
+            merge_products(JSON_OUTPUT_PATH, products)
+            print(f"📁 Saved {len(products)} enriched products to {JSON_OUTPUT_PATH}")
 
-    except Exception as e:
-        print(f"❌ Error processing product {i+1}: {e}")
-        continue
-
-# Load existing data or create new structure
-filename = "gap_products.json"
-try:
-    with open(filename, "r", encoding="utf-8") as f:
-        existing_data = json.load(f)
-    print(f"📖 Loaded existing data from {filename}")
-except FileNotFoundError:
-    existing_data = {
-        "scraped_at": datetime.now().isoformat(),
-        "total_products": 0,
-        "products": [],
-    }
-    print(f"📝 Creating new data file: {filename}")
-
-# Add new products to existing data
-existing_data["products"].extend(all_products)
-existing_data["total_products"] = len(existing_data["products"])
-existing_data["last_updated"] = datetime.now().isoformat()
-
-# Save updated data back to file
-with open(filename, "w", encoding="utf-8") as f:
-    json.dump(existing_data, f, indent=2, ensure_ascii=False)
-
-print(f"\n🎉 Successfully scraped {len(all_products)} products!")
-print(f"📁 Data saved to: {filename}")
-
-time.sleep(5)
-
-driver.quit()
-print("Browser closed")
+        await browser.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl Gap listing pages and enrich the products found.")
+    parser.add_argument("jobs", nargs="?", help="JSON job list; defaults to every CATEGORY_URLS page")
+    parser.add_argument("--no-enrich", action="store_true", help="only crawl listing pages")
+    args = parser.parse_args()
+
+    jobs = load_jobs(args.jobs) if args.jobs else build_jobs()
+    asyncio.run(main(jobs, enrich=not args.no_enrich))
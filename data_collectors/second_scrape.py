@@ -49,7 +49,8 @@ async def scrape_product(browser, product):
         if img_url:
             try:
                 img_data = requests.get(img_url).content
-                img_filename = os.path.join(IMAGE_DIR, f"page{product['page']}_id{product['id']}.jpg")
+                # Listing ids restart on every category page, so the category keeps names unique
+                img_filename = os.path.join(IMAGE_DIR, f"{product['category']}_page{product['page']}_id{product['id']}.jpg")
                 async with aiofiles.open(img_filename, 'wb') as f:
                     await f.write(img_data)
             except Exception as e: